@@ -1,6 +1,10 @@
 import os
-import shutil
+import hashlib
+import logging
+import threading
+import time
 import uuid
+from contextlib import asynccontextmanager
 from typing import List, Optional, Dict, Any
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Query
 from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
@@ -10,11 +14,27 @@ from fastapi.requests import Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from app.utils.readers import parse_file, read_h5_with_schema
-from app.utils.analysis import calculate_stats, filter_data, get_hierarchy_data
-from app.utils.h5_scanner import scan_h5, detect_schema
+# readers / analysis / h5_scanner pull in h5py (and pandas for CSV), they are
+# imported inside the endpoints so cold starts don't pay for them up front
+from app.utils.derived import DerivedColumns, DERIVED_COLUMNS, parse_predicate
+from app.utils.storage import BlobStore, CHUNK_SIZE, H5_EXTENSIONS
+from app.utils.http_cache import ResponseCache, make_etag
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app):
+    # run_gc, load_persisted_caches and warm_catalogs are defined below
+    run_gc(force=True)
+    load_persisted_caches()
+    # Background thread, so the instance accepts requests right away
+    global WARM_THREAD
+    if WARM_CATALOGS > 0:
+        WARM_THREAD = threading.Thread(target=warm_catalogs, args=(WARM_CATALOGS,), daemon=True)
+        WARM_THREAD.start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS Configuration
 # Production Security: Set ALLOWED_ORIGINS="https://your-app.web.app" in Cloud Run
@@ -35,6 +55,149 @@ app.add_middleware(
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "app/uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Content-addressed upload store (identical files are stored once)
+# Unused file_ids expire after UPLOAD_TTL_HOURS, blobs are deleted once nothing references them
+UPLOAD_TTL_HOURS = float(os.getenv("UPLOAD_TTL_HOURS", "24"))
+STORE = BlobStore(UPLOAD_DIR, ttl_seconds=UPLOAD_TTL_HOURS * 3600)
+
+# Derived data, keyed by content hash so all file_ids of the same content share it
+# Simple in-memory cache for schemas
+SCHEMA_CACHE = {}
+# Scan results (dataset list + proposed schema)
+SCAN_CACHE = {}
+# Memoized derived columns and lookup tables (see utils/derived.py)
+DERIVED_CACHE = {}
+# When each schema was ingested, for Last-Modified
+SCHEMA_UPDATED = {}
+
+# Precompressed responses of /stats, /hierarchy and unfiltered /data, on disk
+# max-age=0 + ETag: browsers and the Firebase CDN revalidate and get a cheap 304.
+# Re-ingesting changes the response under the same URL, so only opt into
+# s-maxage (CDN serves without asking us) via HTTP_CACHE_CONTROL if that's acceptable.
+RESPONSE_CACHE = ResponseCache(
+    os.path.join(UPLOAD_DIR, "responses"),
+    cache_control=os.getenv("HTTP_CACHE_CONTROL", "public, max-age=0, must-revalidate")
+)
+
+def run_gc(force=False):
+    """
+    Garbage collects the upload dir and evicts caches of deleted content.
+    """
+    removed = STORE.gc() if force else STORE.maybe_gc()
+    for key in removed:
+        SCHEMA_CACHE.pop(key, None)
+        SCAN_CACHE.pop(key, None)
+        DERIVED_CACHE.pop(key, None)
+        SCHEMA_UPDATED.pop(key, None)
+        RESPONSE_CACHE.invalidate(key)
+
+def response_validators(file_path, cache_key, endpoint, params):
+    """
+    ETag and Last-Modified for a deterministic result. The ETag covers the
+    file content, the schema and the request params.
+    """
+    stat = os.stat(file_path)
+    schema = SCHEMA_CACHE.get(cache_key)
+    etag = make_etag(cache_key, stat.st_size, stat.st_mtime, schema, endpoint, params)
+    last_modified = max(stat.st_mtime, SCHEMA_UPDATED.get(cache_key, 0))
+    return etag, last_modified
+
+def cached_json(request, file_path, cache_key, endpoint, params, build):
+    """
+    Serves a deterministic JSON result with ETag / Last-Modified and compression.
+    `build` only runs if no cached body exists for this combination.
+    """
+    etag, last_modified = response_validators(file_path, cache_key, endpoint, params)
+    return RESPONSE_CACHE.respond(request, cache_key, etag, last_modified, build)
+
+def load_catalog(file_path, schema):
+    """
+    Reads a catalog, with the ingested schema if there is one (for H5).
+    """
+    from app.utils.readers import parse_file, read_h5_with_schema
+
+    if schema and file_path.endswith(H5_EXTENSIONS):
+        return read_h5_with_schema(file_path, schema)
+    return parse_file(file_path)
+
+def get_derived(data, cache_key, names=None):
+    """
+    Lazy derived columns for a catalog, memoized across requests.
+    Requested `names` the catalog can't provide (e.g. n_subhalos for a CSV
+    without ids, or an ingest without parent_id) are a client error.
+    """
+    derived = DerivedColumns(data, cache=DERIVED_CACHE.setdefault(cache_key, {}), schema=SCHEMA_CACHE.get(cache_key))
+    available = derived.available()
+    for name in names or []:
+        if name not in available:
+            needs = ', '.join(DERIVED_COLUMNS[name]['columns'])
+            raise HTTPException(status_code=400, detail=f"Derived column '{name}' needs columns: {needs}")
+    return derived
+
+def check_derived_names(names):
+    for name in names or []:
+        if name not in DERIVED_COLUMNS:
+            raise HTTPException(status_code=400, detail=f"Unknown derived column: {name}")
+
+def load_persisted_caches():
+    """
+    Restores scan results and schemas saved with the blobs by earlier instances.
+    """
+    for cache_key, meta in STORE.load_meta().items():
+        if 'scan' in meta:
+            SCAN_CACHE[cache_key] = meta['scan']
+        if 'schema' in meta:
+            SCHEMA_CACHE[cache_key] = meta['schema']
+            SCHEMA_UPDATED[cache_key] = meta.get('schema_updated', 0)
+
+def warm_catalogs(limit):
+    """
+    Preloads the most recently used catalogs: reads each one once, builds the
+    derived lookup tables and makes sure the default /stats, /data and
+    /hierarchy bodies are in the response cache.
+    """
+    from app.utils.analysis import calculate_stats, filter_data, get_hierarchy_data
+
+    for file_path, cache_key in STORE.recent(limit):
+        try:
+            # Snapshot the schema and the ETags first: if /ingest runs while we
+            # work, nothing built from the old schema may be stored under new keys
+            schema = SCHEMA_CACHE.get(cache_key)
+            # Same params as the endpoints use for their default requests
+            etags = {
+                endpoint: response_validators(file_path, cache_key, endpoint, params)[0]
+                for endpoint, params in (("stats", {"hist": None}), ("data", {}), ("hierarchy", {"root_id": None}))
+            }
+
+            data = load_catalog(file_path, schema)
+            # Private cache, only installed below if the schema is still current
+            derived = DerivedColumns(data, schema=schema)
+            # These build the id lookup tables shared by all derived queries
+            for name in ('n_subhalos', 'host_distance'):
+                if name in derived.available():
+                    derived.get(name)
+
+            builds = {
+                "stats": lambda: calculate_stats(data, derived, None),
+                "data": lambda: filter_data(data, {}, derived, None),
+            }
+            if schema and file_path.endswith(H5_EXTENSIONS):
+                builds["hierarchy"] = lambda: get_hierarchy_data(data, None)
+
+            for endpoint, build in builds.items():
+                if SCHEMA_CACHE.get(cache_key) != schema:
+                    break
+                RESPONSE_CACHE.warm(cache_key, etags[endpoint], build)
+            else:
+                DERIVED_CACHE.setdefault(cache_key, {}).update(derived.cache)
+        except Exception as e:
+            logger.warning("Warmup failed for %s: %s", cache_key, e)
+
+# Number of recently used catalogs preloaded in the background on startup
+WARM_CATALOGS = int(os.getenv("WARM_CATALOGS", "3"))
+# Running warmup thread, if any (benchmark_startup.py waits for it)
+WARM_THREAD = None
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -56,16 +219,24 @@ async def upload_file(file: UploadFile = File(...)):
     if not file.filename.endswith(('.hdf5', '.h5', '.csv')):
         raise HTTPException(status_code=400, detail="Invalid file format. Please upload .hdf5 or .csv")
     
-    file_id = str(uuid.uuid4())
-    file_extension = os.path.splitext(file.filename)[1]
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}{file_extension}")
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    tmp_path = STORE.new_temp_path()
     
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Hash while streaming so we never read the file twice
+        hasher = hashlib.sha256()
+        with open(tmp_path, "wb") as buffer:
+            while chunk := await file.read(CHUNK_SIZE):
+                hasher.update(chunk)
+                buffer.write(chunk)
+        # Duplicate content is dropped here and the new file_id points at the existing blob
+        file_id = STORE.commit(tmp_path, hasher.hexdigest(), file_extension, file.filename)
     except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         raise HTTPException(status_code=500, detail=f"Could not save file: {str(e)}")
-        
+
+    run_gc()
     return {"filename": file.filename, "file_id": file_id}
 
 @app.post("/demo")
@@ -84,22 +255,14 @@ async def load_demo_data():
         raise HTTPException(status_code=500, detail="Failed to generate demo data")
         
     # Simulate Upload
-    file_id = str(uuid.uuid4())
-    destination = os.path.join(UPLOAD_DIR, f"{file_id}.h5")
-    
-    shutil.copy(demo_filename, destination)
-    
-    return {"filename": "Demo Data (NFW Cluster)", "file_id": file_id}
+    # Only the first click copies the file, later clicks just add a reference to the same blob
+    file_id = STORE.add_file(demo_filename, filename=demo_filename)
 
-from app.utils.analysis import calculate_stats, filter_data
-from typing import Optional
+    run_gc()
+    return {"filename": "Demo Data (NFW Cluster)", "file_id": file_id}
 
 # --- New Schema-Agnostic Endpoints ---
 
-from app.utils.h5_scanner import scan_h5, detect_schema
-from app.utils.readers import read_h5_with_schema
-from pydantic import BaseModel
-
 class SchemaMap(BaseModel):
     mass: str
     pos: str
@@ -107,110 +270,131 @@ class SchemaMap(BaseModel):
     parent_id: Optional[str] = None
     radius: Optional[str] = None
 
-# Simple in-memory cache for schemas
-SCHEMA_CACHE = {}
+@app.get("/derived")
+async def list_derived():
+    """
+    Lists the derived columns usable in /data (where, columns) and /stats (hist).
+    """
+    return {name: spec['description'] for name, spec in DERIVED_COLUMNS.items()}
 
 @app.get("/stats/{file_id}")
-async def get_stats(file_id: str):
+async def get_stats(request: Request, file_id: str, hist: Optional[List[str]] = Query(None)):
     # Validate file_id is a UUID
     try:
         uuid.UUID(file_id)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid file ID")
+    check_derived_names(hist)
 
     # Find file with this ID
-    file_path = None
-    for ext in ['.hdf5', '.h5', '.csv']:
-        path = os.path.join(UPLOAD_DIR, f"{file_id}{ext}")
-        if os.path.exists(path):
-            file_path = path
-            break
+    file_path, cache_key = STORE.resolve(file_id)
             
     if not file_path:
         raise HTTPException(status_code=404, detail="File not found")
 
-    try:
+    def build():
+        from app.utils.analysis import calculate_stats
+
         # Use cached schema if available (for H5)
-        if file_id in SCHEMA_CACHE and file_path.endswith(('.h5', '.hdf5')):
-            data = read_h5_with_schema(file_path, SCHEMA_CACHE[file_id])
-        else:
-            data = parse_file(file_path)
+        data = load_catalog(file_path, SCHEMA_CACHE.get(cache_key))
             
-        stats = calculate_stats(data)
+        stats = calculate_stats(data, get_derived(data, cache_key, hist), hist)
         return stats
+
+    try:
+        return cached_json(request, file_path, cache_key, "stats", {"hist": hist}, build)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calculating stats: {str(e)}")
 
 @app.post("/scan/{file_id}")
 async def scan_file(file_id: str):
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}.h5")
-    if not os.path.exists(file_path):
+    file_path, cache_key = STORE.resolve(file_id, H5_EXTENSIONS)
+    if not file_path:
         raise HTTPException(status_code=404, detail="File not found")
     
     try:
-        # Scan H5
+        # Same content was scanned before, reuse it
+        if cache_key in SCAN_CACHE:
+            return SCAN_CACHE[cache_key]
+
+        from app.utils.h5_scanner import scan_h5, detect_schema, sample_datasets
+
+        # Scan H5, then score candidates on a small sample of their values
         datasets = scan_h5(file_path)
-        proposed_schema, _ = detect_schema(datasets)
-        return {"datasets": datasets, "schema": proposed_schema}
+        samples = sample_datasets(file_path, datasets)
+        proposed_schema, _ = detect_schema(datasets, samples)
+        SCAN_CACHE[cache_key] = {"datasets": datasets, "schema": proposed_schema}
+        # Keep it for the next instance too (cold starts)
+        STORE.save_meta(cache_key, scan=SCAN_CACHE[cache_key])
+        return SCAN_CACHE[cache_key]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/ingest/{file_id}")
 async def ingest_data(file_id: str, schema: SchemaMap):
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}.h5")
-    if not os.path.exists(file_path):
+    file_path, cache_key = STORE.resolve(file_id, H5_EXTENSIONS)
+    if not file_path:
         raise HTTPException(status_code=404, detail="File not found")
     
     try:
-        # Cache the schema for this file
-        SCHEMA_CACHE[file_id] = schema.dict()
+        from app.utils.readers import read_h5_with_schema
+
+        # Cache the schema for this file's content
+        SCHEMA_CACHE[cache_key] = schema.dict()
+        SCHEMA_UPDATED[cache_key] = time.time()
+        STORE.save_meta(cache_key, schema=SCHEMA_CACHE[cache_key], schema_updated=SCHEMA_UPDATED[cache_key])
+        # New schema, so previously derived columns and responses are stale
+        DERIVED_CACHE.pop(cache_key, None)
+        RESPONSE_CACHE.invalidate(cache_key)
         
         # Validate reading
-        data = read_h5_with_schema(file_path, SCHEMA_CACHE[file_id])
+        data = read_h5_with_schema(file_path, SCHEMA_CACHE[cache_key])
         return {"status": "success", "particle_count": len(data['mass'])}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/hierarchy/{file_id}")
-async def get_hierarchy(file_id: str, root_id: Optional[str] = None):
+async def get_hierarchy(request: Request, file_id: str, root_id: Optional[str] = None):
     # Validate file_id
     try:
         uuid.UUID(file_id)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid file ID")
 
+    # Validate root_id before it becomes part of a cache entry
+    if root_id is not None:
+        try:
+            root_id = int(root_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid root ID")
+
     # Find file
-    file_path = None
-    for ext in ['.hdf5', '.h5']: # Hierarchy only for H5
-        path = os.path.join(UPLOAD_DIR, f"{file_id}{ext}")
-        if os.path.exists(path):
-            file_path = path
-            break
+    # Hierarchy only for H5 (resolving also keeps the reference alive for gc)
+    file_path, cache_key = STORE.resolve(file_id, H5_EXTENSIONS)
     
     if not file_path:
         return []
 
-    # touch_file(file_path) # Keep alive
-
-    try:
-        # Load schema from cache
-        schema = SCHEMA_CACHE.get(file_id)
-        if schema:
-            data = read_h5_with_schema(file_path, schema)
-        else:
-            # Fallback
-            data = parse_file(file_path)
-            if 'parent_id' not in data:
-                return []
+    def build():
+        # Load schema from cache, parse_file fallback has no hierarchy
+        data = load_catalog(file_path, SCHEMA_CACHE.get(cache_key))
+        if 'parent_id' not in data:
+            return []
 
         from app.utils.analysis import get_hierarchy_data
         nodes = get_hierarchy_data(data, root_id)
         return nodes
+
+    try:
+        return cached_json(request, file_path, cache_key, "hierarchy", {"root_id": root_id}, build)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting hierarchy: {str(e)}")
 
 @app.get("/data/{file_id}")
 async def get_data(
+    request: Request,
     file_id: str,
     min_mass: Optional[float] = None,
     max_mass: Optional[float] = None,
@@ -221,7 +405,9 @@ async def get_data(
     y_min: Optional[float] = None,
     y_max: Optional[float] = None,
     z_min: Optional[float] = None,
-    z_max: Optional[float] = None
+    z_max: Optional[float] = None,
+    where: Optional[List[str]] = Query(None),
+    columns: Optional[List[str]] = Query(None)
 ):
     # Validate file_id is a UUID
     try:
@@ -229,34 +415,47 @@ async def get_data(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid file ID")
 
+    # Derived column filters, e.g. ?where=log_mass>=12&where=n_subhalos>0
+    try:
+        predicates = [parse_predicate(text) for text in where or []]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    check_derived_names(columns)
+
     # Find file
-    file_path = None
-    for ext in ['.hdf5', '.h5', '.csv']:
-        path = os.path.join(UPLOAD_DIR, f"{file_id}{ext}")
-        if os.path.exists(path):
-            file_path = path
-            break
+    file_path, cache_key = STORE.resolve(file_id)
     
     if not file_path:
         raise HTTPException(status_code=404, detail="File not found")
 
-    try:
+    # Apply Filters
+    filters = {
+        'min_mass': min_mass, 'max_mass': max_mass,
+        'min_radius': min_radius, 'max_radius': max_radius,
+        'x_min': x_min, 'x_max': x_max,
+        'y_min': y_min, 'y_max': y_max,
+        'z_min': z_min, 'z_max': z_max,
+        'derived': predicates
+    }
+
+    def build():
+        from app.utils.analysis import filter_data
+
         # Use cached schema if available (for H5)
-        if file_id in SCHEMA_CACHE and file_path.endswith(('.h5', '.hdf5')):
-            data = read_h5_with_schema(file_path, SCHEMA_CACHE[file_id])
-        else:
-            data = parse_file(file_path)
+        data = load_catalog(file_path, SCHEMA_CACHE.get(cache_key))
             
-        # Apply Filters
-        filters = {
-            'min_mass': min_mass, 'max_mass': max_mass,
-            'min_radius': min_radius, 'max_radius': max_radius,
-            'x_min': x_min, 'x_max': x_max,
-            'y_min': y_min, 'y_max': y_max,
-            'z_min': z_min, 'z_max': z_max
-        }
-        filtered_data = filter_data(data, filters)
+        names = [name for name, _, _ in predicates] + (columns or [])
+        filtered_data = filter_data(data, filters, get_derived(data, cache_key, names), columns)
         
         return filtered_data
+
+    try:
+        # Only the full catalog view is cached, filter combinations are too many
+        unfiltered = not predicates and not columns and all(v is None for k, v in filters.items() if k != 'derived')
+        if unfiltered:
+            return cached_json(request, file_path, cache_key, "data", {}, build)
+        return build()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error parsing file: {str(e)}")
@@ -1,9 +1,13 @@
 import numpy as np
-from scipy import stats
 
-def filter_data(data: dict, filters: dict):
+from app.utils.derived import COMPARISONS, to_json_list
+
+def filter_data(data: dict, filters: dict, derived=None, columns=None):
     """
     Filters the data dictionary based on provided ranges.
+    filters['derived'] may hold (name, op, value) predicates on derived columns,
+    and `columns` lists derived columns to add to the output. Both are only
+    evaluated on the selected rows, through `derived` (a DerivedColumns).
     Returns a new dictionary with filtered arrays.
     """
 
@@ -41,13 +45,28 @@ def filter_data(data: dict, filters: dict):
     if 'z_max' in filters and filters['z_max'] is not None:
         mask &= (arrays['z'] <= filters['z_max'])
 
+    # Derived column predicates, each evaluated only on the rows still selected
+    if derived is not None and filters.get('derived'):
+        for name, op, value in filters['derived']:
+            rows = np.where(mask)[0]
+            with np.errstate(invalid='ignore'):
+                mask[rows] &= COMPARISONS[op](derived.get(name, rows), value)
+
     # Apply mask to all arrays
     filtered_data = {k: v[mask].tolist() for k, v in arrays.items()}
+
+    # Requested derived columns, for the selected rows only
+    if derived is not None and columns:
+        rows = np.where(mask)[0]
+        for name in columns:
+            filtered_data[name] = to_json_list(derived.get(name, rows))
+
     return filtered_data
 
-def calculate_stats(data: dict):
+def calculate_stats(data: dict, derived=None, histograms=None):
     """
     Calculates basic statistics for the halo catalog.
+    `histograms` lists derived columns (from `derived`, a DerivedColumns) to histogram.
     """
     stats_output = {}
     
@@ -124,6 +143,25 @@ def calculate_stats(data: dict):
                     'bin_centers': r_bin_centers.tolist()
                 }
 
+        # Derived Column Histograms
+        if derived is not None and histograms:
+            stats_output['derived_histograms'] = {}
+            for name in histograms:
+                values = derived.get(name)
+                values = values[np.isfinite(values)]
+                if len(values) == 0:
+                    stats_output['derived_histograms'][name] = None
+                    continue
+
+                d_min, d_max = np.min(values), np.max(values)
+                d_bins = np.linspace(d_min, d_max, 20) if d_max > d_min else 1
+                d_hist, d_bin_edges = np.histogram(values, bins=d_bins)
+                stats_output['derived_histograms'][name] = {
+                    'counts': d_hist.tolist(),
+                    'bin_edges': d_bin_edges.tolist(),
+                    'bin_centers': ((d_bin_edges[:-1] + d_bin_edges[1:]) / 2).tolist()
+                }
+
     return stats_output
 
 def get_hierarchy_data(data, root_id=None):
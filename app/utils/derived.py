@@ -0,0 +1,216 @@
+import operator
+import re
+import numpy as np
+
+# numexpr is optional, it's faster and lighter on memory for big catalogs
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# Gravitational constant in Mpc (km/s)^2 / M_sun
+# (catalogs use M_sun for mass and Mpc for positions and radii)
+G_MPC = 4.30091e-9
+
+# Functions expressions may use when evaluated without numexpr
+NUMPY_FUNCS = {
+    'log10': np.log10,
+    'log': np.log,
+    'exp': np.exp,
+    'sqrt': np.sqrt,
+    'abs': np.abs,
+}
+
+# Elementwise derived columns, defined as expressions over the ingested columns
+EXPRESSIONS = {
+    'log_mass': {
+        'expr': 'log10(mass)',
+        'columns': ['mass'],
+        'description': 'log10 of halo mass'
+    },
+    'log_radius': {
+        'expr': 'log10(radius)',
+        'columns': ['radius'],
+        'description': 'log10 of halo radius'
+    },
+    'v_vir': {
+        'expr': 'sqrt(G * mass / radius)',
+        'columns': ['mass', 'radius'],
+        'description': 'Virial velocity sqrt(GM/R) in km/s'
+    },
+}
+
+# Derived columns that need the whole catalog (lookups by id), see DerivedColumns
+CATALOG_COLUMNS = {
+    'host_distance': {
+        'columns': ['id', 'parent_id', 'x', 'y', 'z'],
+        'description': 'Distance to the host halo (empty for top-level halos)'
+    },
+    'n_subhalos': {
+        'columns': ['id', 'parent_id'],
+        'description': 'Number of direct subhalos'
+    },
+}
+
+DERIVED_COLUMNS = {**EXPRESSIONS, **CATALOG_COLUMNS}
+
+# Optional schema fields, readers.py fills them with placeholders (zeros, -1)
+# when they weren't mapped, so only the schema tells if they're real
+OPTIONAL_FIELDS = ('radius', 'parent_id')
+
+# If a query selects at least this fraction of the rows, the full column is
+# computed and memoized instead (costs at most ~2x once, then it's free).
+# Smaller selections are computed on the fly and not memoized.
+FULL_COLUMN_FRACTION = 0.5
+
+# Comparison operators allowed in filter predicates like "log_mass>=12"
+COMPARISONS = {
+    '>=': operator.ge,
+    '<=': operator.le,
+    '>': operator.gt,
+    '<': operator.lt,
+    '==': operator.eq,
+}
+PREDICATE_RE = re.compile(r'^\s*(\w+)\s*(>=|<=|==|>|<)\s*([-+0-9.eE]+)\s*$')
+
+def parse_predicate(text):
+    """
+    Parses a predicate such as "v_vir > 200" into (name, op, value).
+    """
+    match = PREDICATE_RE.match(text)
+    if not match:
+        raise ValueError(f"Invalid filter expression: {text}")
+    name, op, value = match.groups()
+    if name not in DERIVED_COLUMNS:
+        raise ValueError(f"Unknown derived column: {name}")
+    try:
+        return name, op, float(value)
+    except ValueError:
+        # The pattern also matches things like "1.2.3" or "e"
+        raise ValueError(f"Invalid filter expression: {text}")
+
+def evaluate(expr, columns):
+    """
+    Evaluates an expression over a dict of numpy arrays.
+    """
+    constants = {'G': G_MPC}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if numexpr is not None:
+            return numexpr.evaluate(expr, local_dict=columns, global_dict=constants)
+        return eval(expr, {'__builtins__': {}, **NUMPY_FUNCS, **constants}, columns)
+
+class DerivedColumns:
+    """
+    Lazy derived columns for one catalog.
+
+    Values are computed only for the requested rows, unless the rows are a
+    large part of the catalog (FULL_COLUMN_FRACTION). Full columns and the id
+    lookup tables are memoized in `cache`, which the caller keeps per catalog
+    so they survive between requests. `schema` is the ingested schema the
+    data was read with, if any.
+    """
+
+    def __init__(self, data, cache=None, schema=None):
+        self.data = data
+        self.cache = cache if cache is not None else {}
+        self.schema = schema
+        self._arrays = {}
+
+    def _column(self, name):
+        # readers.py may return lists, convert once
+        if name not in self._arrays:
+            self._arrays[name] = np.asarray(self.data[name])
+        return self._arrays[name]
+
+    def available(self):
+        """Names of derived columns that can be computed for this catalog."""
+        unmapped = [field for field in OPTIONAL_FIELDS if self.schema is not None and not self.schema.get(field)]
+        return [
+            name for name, spec in DERIVED_COLUMNS.items()
+            if all(self.data.get(col) is not None and col not in unmapped for col in spec['columns'])
+        ]
+
+    def get(self, name, rows=None):
+        """
+        Returns derived column `name`, for all rows or only the given row indices.
+        """
+        if name not in DERIVED_COLUMNS:
+            raise ValueError(f"Unknown derived column: {name}")
+        if name not in self.available():
+            raise ValueError(f"Derived column '{name}' needs columns: {', '.join(DERIVED_COLUMNS[name]['columns'])}")
+
+        # Full column already computed, just index it
+        if name in self.cache:
+            values = self.cache[name]
+            return values if rows is None else values[rows]
+
+        # Large selection: compute the whole column once so later queries reuse it
+        n_rows = len(self._column(DERIVED_COLUMNS[name]['columns'][0]))
+        if rows is not None and len(rows) >= FULL_COLUMN_FRACTION * n_rows:
+            return self.get(name)[rows]
+
+        if name in EXPRESSIONS:
+            spec = EXPRESSIONS[name]
+            columns = {}
+            for col in spec['columns']:
+                values = self._column(col)
+                columns[col] = (values if rows is None else values[rows]).astype(float)
+            values = evaluate(spec['expr'], columns)
+        elif name == 'host_distance':
+            values = self._host_distance(rows)
+        else:
+            values = self._n_subhalos(rows)
+
+        if rows is None:
+            self.cache[name] = values
+        return values
+
+    def _id_lookup(self):
+        # Sorted ids and their row indices, for searchsorted lookups by id
+        if '_id_lookup' not in self.cache:
+            ids = self._column('id')
+            order = np.argsort(ids, kind='stable')
+            self.cache['_id_lookup'] = (ids[order], order)
+        return self.cache['_id_lookup']
+
+    def _host_distance(self, rows):
+        rows = np.arange(len(self._column('id'))) if rows is None else rows
+        sorted_ids, order = self._id_lookup()
+        parents = self._column('parent_id')[rows]
+
+        # Find the row of each parent, -1 if it has none / isn't in the catalog
+        pos = np.clip(np.searchsorted(sorted_ids, parents), 0, len(sorted_ids) - 1)
+        found = (parents >= 0) & (sorted_ids[pos] == parents)
+        host_rows = order[pos]
+
+        distance = np.full(len(rows), np.nan)
+        sq = np.zeros(np.count_nonzero(found))
+        for axis in ('x', 'y', 'z'):
+            coord = self._column(axis)
+            sq += (coord[rows[found]] - coord[host_rows[found]]) ** 2
+        distance[found] = np.sqrt(sq)
+        return distance
+
+    def _n_subhalos(self, rows):
+        # Children per parent id, counted once over the whole catalog
+        if '_child_counts' not in self.cache:
+            parents = self._column('parent_id')
+            self.cache['_child_counts'] = np.unique(parents[parents >= 0], return_counts=True)
+        parent_ids, counts = self.cache['_child_counts']
+
+        ids = self._column('id')
+        ids = ids if rows is None else ids[rows]
+        if len(parent_ids) == 0:
+            return np.zeros(len(ids), dtype=int)
+
+        pos = np.clip(np.searchsorted(parent_ids, ids), 0, len(parent_ids) - 1)
+        return np.where(parent_ids[pos] == ids, counts[pos], 0)
+
+def to_json_list(values):
+    """Converts an array to a list, with NaN/inf (not valid JSON) as None."""
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        finite = np.isfinite(values)
+        if not np.all(finite):
+            return [float(v) if ok else None for v, ok in zip(values, finite)]
+    return values.tolist()
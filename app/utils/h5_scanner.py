@@ -1,5 +1,6 @@
 import h5py
 import re
+import numpy as np
 
 def scan_h5(file_path):
     """
@@ -21,9 +22,202 @@ def scan_h5(file_path):
     
     return datasets
 
-def detect_schema(datasets):
+# Content sampling: a few contiguous blocks spread evenly over each dataset.
+# Contiguous blocks (instead of a single ::step slice) keep reads chunk-friendly
+# and still let us check monotonicity inside each block.
+# At most SAMPLE_BLOCKS * SAMPLE_BLOCK_SIZE rows are read per dataset, so the
+# cost depends on the number of datasets, not on the size of the file.
+SAMPLE_BLOCKS = 8
+SAMPLE_BLOCK_SIZE = 256
+
+# With samples, the best candidate for a field must score above this,
+# otherwise the field is left empty for the user to map
+MIN_SAMPLED_SCORE = 0
+
+def _is_column(ds):
+    shape = ds['shape']
+    return ds['ndim'] == 1 or (ds['ndim'] == 2 and (shape[1] == 1 or shape[0] == 1))
+
+def _is_vector3(ds):
+    shape = ds['shape']
+    return ds['ndim'] == 2 and (shape[1] == 3 or shape[0] == 3)
+
+def _read_sample(dset):
+    """
+    Reads up to SAMPLE_BLOCKS blocks of SAMPLE_BLOCK_SIZE rows along the long axis.
+    Returns a list of blocks, 1D for columns and (rows, 3) for vectors.
+    """
+    # Rows run along the longest axis, so (3, N) and (1, N) layouts work too
+    axis = int(np.argmax(dset.shape))
+    n = dset.shape[axis]
+    if n == 0:
+        return []
+
+    if n <= SAMPLE_BLOCKS * SAMPLE_BLOCK_SIZE:
+        starts = [0]
+        size = n
+    else:
+        starts = np.linspace(0, n - SAMPLE_BLOCK_SIZE, SAMPLE_BLOCKS).astype(int)
+        size = SAMPLE_BLOCK_SIZE
+
+    blocks = []
+    for start in starts:
+        if axis == 0:
+            block = dset[start:start + size]
+        else:
+            block = dset[:, start:start + size].T
+        if block.ndim == 2 and block.shape[1] == 1:
+            block = block[:, 0]
+        blocks.append(block)
+    return blocks
+
+def sample_datasets(file_path, datasets):
+    """
+    Reads a small strided sample from every numeric candidate dataset.
+    Returns a dict {path: list of sample blocks}.
+    """
+    samples = {}
+
+    with h5py.File(file_path, 'r') as f:
+        for ds in datasets:
+            if not (_is_column(ds) or _is_vector3(ds)):
+                continue
+            dset = f[ds['path']]
+            # Skip strings, compound types etc.
+            if dset.dtype.kind not in 'iuf':
+                continue
+            blocks = _read_sample(dset)
+            if blocks:
+                samples[ds['path']] = blocks
+
+    return samples
+
+def _content_score(field, blocks, id_values=None):
+    """
+    Scores how well sampled values look like the given field.
+    Positive means plausible, strongly negative means the values rule it out.
+    """
+    values = np.concatenate(blocks)
+    if field == 'pos':
+        values = values[np.all(np.isfinite(values), axis=1)]
+    else:
+        values = values[np.isfinite(values)] if values.dtype.kind == 'f' else values
+    if len(values) == 0:
+        return -50
+
+    is_int = values.dtype.kind in 'iu' or np.all(values == np.round(values))
+    score = 0
+
+    if field == 'id':
+        # Monotonic unique integers
+        if not is_int:
+            return -50
+        if len(np.unique(values)) == len(values): score += 20
+        else: score -= 20
+        if all(np.all(np.diff(b) > 0) for b in blocks if len(b) > 1): score += 10
+        if np.min(values) >= 0: score += 5
+
+    elif field == 'mass':
+        # Positive, spans a wide (log-normal like) range
+        if np.any(values <= 0):
+            return -50
+        log_m = np.log10(values)
+        if np.ptp(log_m) >= 1: score += 15
+        if not is_int: score += 5
+        # Log-normal: skewed in linear space, roughly symmetric in log space
+        if np.mean(values) > np.median(values): score += 5
+
+    elif field == 'radius':
+        # Positive and spans a narrower range than a mass would (R ~ M^1/3)
+        if np.any(values <= 0):
+            return -50
+        log_r = np.log10(values)
+        if np.ptp(log_r) < 3: score += 10
+        if not is_int: score += 5
+
+    elif field == 'pos':
+        # Bounded box with comparable extent along all three axes
+        extent = np.ptp(values, axis=0)
+        if np.all(extent > 0):
+            score += 10
+            if np.max(extent) / np.min(extent) < 3: score += 10
+        # Simulation boxes usually start at the origin, velocities don't
+        if np.min(values) >= 0: score += 5
+        if is_int: score -= 10
+
+    elif field == 'parent_id':
+        # Integers referencing ids, with repeats (hosts have many subhalos)
+        # and usually a negative sentinel for top level halos
+        if not is_int:
+            return -50
+        has_sentinel = np.any(values < 0)
+        has_repeats = len(np.unique(values)) < len(values)
+        # Every halo being its own parent / having a distinct parent isn't a hierarchy
+        if not has_sentinel and not has_repeats:
+            return -50
+        if id_values is not None and np.array_equal(values, id_values):
+            return -50
+        # A hierarchy has roots: a negative sentinel, or hosts pointing at themselves.
+        # Group numberings (GroupID etc.) repeat a lot but have no roots.
+        has_self_refs = id_values is not None and values.shape == id_values.shape and np.mean(values == id_values) > 0.01
+        if not has_sentinel and not has_self_refs:
+            return -50
+        score += 20
+        if has_repeats: score += 5
+        if id_values is not None:
+            refs = values[values >= 0]
+            if len(refs) > 0:
+                in_range = np.mean((refs >= np.min(id_values)) & (refs <= np.max(id_values)))
+                score += 20 * in_range - 10
+                # Sample of ids is partial, so this only adds a bonus
+                score += 10 * np.mean(np.isin(refs, id_values))
+
+    return score
+
+def _name_score(field, path):
+    """
+    Scores a candidate path by name for the given field.
+    """
+    score = 0
+    basename = path.split('/')[-1]
+
+    # Base score: length penalty (prefer 'id' over 'particle_ids_long_name')
+    score -= len(basename) * 0.5
+
+    if field == 'id':
+        # Critical: Penalize likely parent fields
+        if 'parent' in path or 'host' in path or 'group' in path:
+            score -= 50
+
+        if basename == 'id': score += 20
+        elif 'id' in basename: score += 10
+        elif 'index' in basename: score += 5
+
+    elif field == 'parent_id':
+        if 'parent' in basename: score += 20
+        elif 'host' in basename: score += 10
+        elif 'group' in basename: score += 5
+
+    elif field == 'mass':
+        if basename == 'mass': score += 20
+        elif 'mass' in basename: score += 10
+
+    elif field == 'pos':
+        if 'coord' in basename: score += 15
+        elif 'pos' in basename: score += 10
+
+    elif field == 'radius':
+        if 'radius' in basename: score += 20
+        elif 'r200' in basename: score += 15
+        elif 'vir' in basename: score += 10
+
+    return score
+
+def detect_schema(datasets, samples=None):
     """
     Heuristically detects schema fields from a list of datasets.
+    If samples (from sample_datasets) are given, candidates are also scored
+    on their values, and datasets with unhelpful names can still be picked.
     """
     schema = {
         'mass': None,
@@ -42,76 +236,66 @@ def detect_schema(datasets):
         'radius': [r'rad', r'r200', r'rvir', r'size']
     }
 
-    # Scoring candidates
+    # Scoring candidates, as (dataset, name matched) pairs
     candidates = {k: [] for k in schema.keys()}
 
     for ds in datasets:
         path_lower = ds['path'].lower()
-        shape = ds['shape']
-        ndim = ds['ndim']
         
-        
-        if ndim == 2 and (shape[1] == 3 or shape[0] == 3):
-            candidates['pos'].append(ds)
+        if _is_vector3(ds):
+            candidates['pos'].append((ds, True))
             continue
 
-        
-        if ndim == 1 or (ndim == 2 and (shape[1] == 1 or shape[0] == 1)):
+        if _is_column(ds):
             # Check keywords
             for field, regex_list in patterns.items():
                 if field == 'pos': continue # Already handled
                 
-                for pattern in regex_list:
-                    if re.search(pattern, path_lower):
-                        candidates[field].append(ds)
-                        break
-    
-    # Select best candidates, simple first match for now
-    for field in schema.keys():
-        if candidates[field]:
-            # Advanced Scoring System
-            best_cand = None
-            best_score = -999
-            
-            for cand in candidates[field]:
-                score = 0
-                path = cand['path'].lower()
-                basename = path.split('/')[-1]
-                
-                # Base score: length penalty (prefer 'id' over 'particle_ids_long_name')
-                score -= len(basename) * 0.5
-                
-                if field == 'id':
-                    # Critical: Penalize likely parent fields
-                    if 'parent' in path or 'host' in path or 'group' in path: 
-                        score -= 50 
-                    
-                    if basename == 'id': score += 20
-                    elif 'id' in basename: score += 10
-                    elif 'index' in basename: score += 5
-                    
-                elif field == 'parent_id':
-                    if 'parent' in basename: score += 20
-                    elif 'host' in basename: score += 10
-                    elif 'group' in basename: score += 5
-                    
-                elif field == 'mass':
-                    if basename == 'mass': score += 20
-                    elif 'mass' in basename: score += 10
-                    
-                elif field == 'pos':
-                    if 'coord' in basename: score += 15
-                    elif 'pos' in basename: score += 10
-                    
-                elif field == 'radius':
-                    if 'radius' in basename: score += 20
-                    elif 'r200' in basename: score += 15
-                    elif 'vir' in basename: score += 10
-
-                if best_cand is None or score > best_score:
-                    best_score = score
-                    best_cand = cand
-            
+                matched = any(re.search(pattern, path_lower) for pattern in regex_list)
+                if matched:
+                    candidates[field].append((ds, True))
+                elif samples is not None and ds['path'] in samples:
+                    # Unnamed columns only compete on content
+                    candidates[field].append((ds, False))
+
+    # Fields are resolved in order so parent_id can be checked against the chosen ids
+    # and all fields can prefer the catalog length of the positions
+    n_rows = None
+    id_values = None
+    # A dataset can only be mapped to one field
+    assigned = set()
+
+    for field in ['pos', 'id', 'mass', 'radius', 'parent_id']:
+        best_cand = None
+        best_score = -999
+
+        for cand, matched in candidates[field]:
+            if cand['path'] in assigned:
+                continue
+
+            if matched:
+                score = _name_score(field, cand['path'].lower())
+            else:
+                score = -20
+
+            if samples is not None and cand['path'] in samples:
+                score += _content_score(field, samples[cand['path']], id_values)
+                if n_rows is not None and max(cand['shape']) == n_rows:
+                    score += 5
+            elif not matched:
+                continue
+
+            if best_cand is None or score > best_score:
+                best_score = score
+                best_cand = cand
+
+        # With samples, reject candidates whose content doesn't fit
+        if best_cand is not None and (samples is None or best_score > MIN_SAMPLED_SCORE):
             schema[field] = best_cand['path']
+            assigned.add(best_cand['path'])
+            if field == 'pos':
+                n_rows = max(best_cand['shape'])
+            elif field == 'id' and samples is not None and best_cand['path'] in samples:
+                id_values = np.concatenate(samples[best_cand['path']])
 
     return schema, datasets
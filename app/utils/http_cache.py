@@ -0,0 +1,228 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+# zstd and brotli are optional, gzip is always available
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bump when the response format of a cached endpoint changes
+RESPONSE_VERSION = 1
+
+# Smaller bodies are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# Max distinct responses (ETags) kept per catalog, least recently used are evicted
+MAX_ENTRIES_PER_KEY = 64
+
+# Server preference order if the client accepts several encodings equally
+ENCODERS = {}
+if zstandard is not None:
+    ENCODERS['zstd'] = lambda body: zstandard.ZstdCompressor(level=10).compress(body)
+if brotli is not None:
+    ENCODERS['br'] = lambda body: brotli.compress(body, quality=6)
+ENCODERS['gzip'] = lambda body: gzip.compress(body, compresslevel=6)
+
+def make_etag(*parts):
+    """
+    Strong ETag from the parts that determine a response (content hash, schema, params...).
+    """
+    key = json.dumps([RESPONSE_VERSION, *parts], sort_keys=True, default=str)
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+def encoded_etag(etag, encoding):
+    """
+    ETag of one encoding of a response. Each encoding is a different byte
+    sequence, so it gets its own strong tag ("<hash>-gzip").
+    """
+    if encoding == 'identity':
+        return etag
+    return etag[:-1] + '-' + encoding + '"'
+
+def negotiate_encoding(accept_encoding):
+    """
+    Picks the best supported encoding from an Accept-Encoding header, 'identity' if none.
+    """
+    qualities = {}
+    for item in (accept_encoding or '').split(','):
+        token, _, params = item.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualities[token] = q
+
+    best, best_q = 'identity', 0.0
+    for encoding in ENCODERS:
+        q = qualities.get(encoding, qualities.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        # Weak comparison, intermediaries may weaken our tags after compressing
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        # Any encoding of the same response is still current
+        current = {etag} | {encoded_etag(etag, encoding) for encoding in ENCODERS}
+        return '*' in tags or any(tag in current for tag in tags)
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+class ResponseCache:
+    """
+    Conditional (ETag / Last-Modified) and precompressed JSON responses.
+
+    Encoded bodies are stored on disk under cache_dir/<cache_key>/<etag>.<encoding>,
+    so repeat requests skip both the computation and the compression.
+    Each catalog keeps at most max_entries ETags, evicted by last use (mtime).
+    """
+
+    def __init__(self, cache_dir, cache_control='public, max-age=0, must-revalidate', max_entries=MAX_ENTRIES_PER_KEY):
+        self.cache_dir = cache_dir
+        self.cache_control = cache_control
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, cache_key, etag, encoding):
+        return os.path.join(self.cache_dir, cache_key, etag.strip('"') + '.' + encoding)
+
+    def invalidate(self, cache_key):
+        """Drops all cached bodies of one catalog (new schema, deleted file...)."""
+        shutil.rmtree(os.path.join(self.cache_dir, cache_key), ignore_errors=True)
+
+    def respond(self, request, cache_key, etag, last_modified, build):
+        """
+        Returns a 304 if the client's copy is current, otherwise the cached
+        (or freshly built via `build()`) JSON body in the negotiated encoding.
+        """
+        headers = {
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+        if last_modified is not None:
+            headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+
+        encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+        if encoding != 'identity' and self._is_small(cache_key, etag):
+            encoding = 'identity'
+
+        if _not_modified(request, etag, last_modified):
+            headers['ETag'] = encoded_etag(etag, encoding)
+            return Response(status_code=304, headers=headers)
+
+        path = self._path(cache_key, etag, encoding)
+        if os.path.exists(path):
+            body = self._read(path)
+        else:
+            raw = self._raw(cache_key, etag, build)
+
+            if len(raw) < MIN_COMPRESS_SIZE:
+                encoding = 'identity'
+                body = raw
+            elif encoding == 'identity':
+                body = raw
+            else:
+                body = ENCODERS[encoding](raw)
+                self._write(path, body)
+
+        headers['ETag'] = encoded_etag(etag, encoding)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(content=body, media_type='application/json', headers=headers)
+
+    def warm(self, cache_key, etag, build):
+        """Makes sure the uncompressed body for `etag` exists on disk."""
+        self._raw(cache_key, etag, build)
+
+    def _is_small(self, cache_key, etag):
+        # Bodies below MIN_COMPRESS_SIZE are always sent uncompressed
+        try:
+            return os.path.getsize(self._path(cache_key, etag, 'identity')) < MIN_COMPRESS_SIZE
+        except OSError:
+            return False  # Not built yet
+
+    def _raw(self, cache_key, etag, build):
+        identity_path = self._path(cache_key, etag, 'identity')
+        if os.path.exists(identity_path):
+            return self._read(identity_path)
+
+        # Same serialization as FastAPI's default JSONResponse
+        raw = json.dumps(
+            jsonable_encoder(build()),
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(',', ':')
+        ).encode('utf-8')
+        self._write(identity_path, raw)
+        self._evict(cache_key)
+        return raw
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            body = f.read()
+        # Mark as recently used for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return body
+
+    def _evict(self, cache_key):
+        """Drops the least recently used ETags of a catalog beyond max_entries."""
+        key_dir = os.path.join(self.cache_dir, cache_key)
+        last_used = {}
+        try:
+            for name in os.listdir(key_dir):
+                if '.tmp-' in name:
+                    continue
+                tag = name.split('.')[0]
+                mtime = os.path.getmtime(os.path.join(key_dir, name))
+                last_used[tag] = max(last_used.get(tag, 0), mtime)
+        except OSError:
+            return
+
+        for tag in sorted(last_used, key=last_used.get)[:-self.max_entries or None]:
+            for name in os.listdir(key_dir):
+                if name.split('.')[0] == tag:
+                    try:
+                        os.remove(os.path.join(key_dir, name))
+                    except OSError:
+                        pass  # Removed concurrently
+
+    def _write(self, path, body):
+        # Write then rename so concurrent readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{uuid.uuid4()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
@@ -1,5 +1,4 @@
 import h5py
-import pandas as pd
 import numpy as np
 import os
 
@@ -64,6 +63,8 @@ def parse_file(file_path: str):
             data['radius'] = get_data(['Radius', 'radius', 'r'])
 
     elif file_path.endswith('.csv'):
+        # pandas is slow to import, only load it for CSV files
+        import pandas as pd
         df = pd.read_csv(file_path)
         df.columns = df.columns.str.lower().str.strip()
         
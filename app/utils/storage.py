@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Not available on Windows, there the index is only locked within one process
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Content-addressed storage for uploads.
+# Every file is stored once under blobs/<sha256><ext>; a file_id is just a
+# lightweight reference pointing at a blob. Identical uploads (and every click
+# on /demo) therefore share one blob, one scan and one set of caches.
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB streaming chunks
+H5_EXTENSIONS = ('.hdf5', '.h5')
+ALLOWED_EXTENSIONS = H5_EXTENSIONS + ('.csv',)
+
+# Old-style uploads were saved directly as <uuid><ext> in the upload dir
+LEGACY_FILE_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.(h5|hdf5|csv)$')
+
+
+class BlobStore:
+    """
+    Deduplicating upload store with reference counting and TTL garbage collection.
+
+    Layout inside upload_dir:
+        blobs/<sha256><ext>   one copy of each distinct file content
+        blobs/.tmp-<uuid>     uploads still being streamed in
+        index.json            refs (file_id -> blob) and blob refcounts
+        index.lock            held while index.json is read and rewritten
+
+    Several processes (workers) may share one upload_dir, so every change
+    reloads the index under the file lock and writes it back before releasing it.
+    """
+
+    def __init__(self, upload_dir, ttl_seconds=24 * 3600, gc_interval=600):
+        self.upload_dir = upload_dir
+        self.blob_dir = os.path.join(upload_dir, 'blobs')
+        self.index_path = os.path.join(upload_dir, 'index.json')
+        self.lock_path = os.path.join(upload_dir, 'index.lock')
+        self.ttl_seconds = ttl_seconds
+        self.gc_interval = gc_interval
+        self._lock = threading.Lock()
+        self._last_gc = 0.0
+        # (path, size, mtime) -> sha256, so the demo file is only hashed once
+        self._hash_cache = {}
+        # file_id -> last access, not written yet (see resolve)
+        self._touched = {}
+
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    # --- Index persistence ---
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    index = json.load(f)
+                index.setdefault('refs', {})
+                index.setdefault('blobs', {})
+                return index
+            except (OSError, ValueError):
+                pass  # Corrupt index, start fresh (orphan blobs are collected by gc)
+        return {'refs': {}, 'blobs': {}}
+
+    def _save_index(self):
+        # Write then rename so a crash never leaves a half-written index
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    @contextmanager
+    def _locked(self, save=True):
+        """
+        Holds the thread and file lock with a freshly loaded index, so changes
+        of other processes are merged instead of overwritten.
+        """
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the file is closed
+            self._index = self._load_index()
+            refs = self._index['refs']
+            for file_id, last_access in self._touched.items():
+                if file_id in refs:
+                    refs[file_id]['last_access'] = max(refs[file_id]['last_access'], last_access)
+            yield self._index
+            if save:
+                self._save_index()
+                self._touched = {}
+
+    def _blob_path(self, content_hash, ext):
+        return os.path.join(self.blob_dir, f"{content_hash}{ext}")
+
+    # --- Adding content ---
+
+    def new_temp_path(self):
+        """Path for streaming a new upload into before its hash is known."""
+        return os.path.join(self.blob_dir, f".tmp-{uuid.uuid4()}")
+
+    def commit(self, tmp_path, content_hash, ext, filename=None):
+        """
+        Moves a fully written temp file into the store (or drops it if the
+        content already exists) and returns a new file_id referencing it.
+        """
+        with self._locked():
+            blob = self._index['blobs'].get(content_hash)
+            if blob is None:
+                os.replace(tmp_path, self._blob_path(content_hash, ext))
+                self._index['blobs'][content_hash] = {'ext': ext, 'size': os.path.getsize(self._blob_path(content_hash, ext)), 'refcount': 0}
+            elif os.path.exists(self._blob_path(content_hash, blob['ext'])):
+                # Duplicate content, keep the existing blob
+                os.remove(tmp_path)
+            else:
+                # Blob file was lost, restore it but keep its refs and metadata
+                os.replace(tmp_path, self._blob_path(content_hash, blob['ext']))
+
+            file_id = self._add_ref(content_hash, filename)
+        return file_id
+
+    def add_file(self, source_path, filename=None):
+        """
+        Adds an existing file on disk (e.g. the demo catalog) without moving it.
+        The file is only copied if its content is not stored yet.
+        """
+        content_hash = self.hash_file(source_path)
+        ext = os.path.splitext(source_path)[1].lower()
+
+        with self._locked():
+            blob = self._index['blobs'].get(content_hash)
+            if blob is None or not os.path.exists(self._blob_path(content_hash, blob['ext'])):
+                if blob is None:
+                    blob = {'ext': ext, 'size': os.path.getsize(source_path), 'refcount': 0}
+                    self._index['blobs'][content_hash] = blob
+                # New content, or a lost blob file (its refs and metadata are kept)
+                tmp_path = self.new_temp_path()
+                shutil.copy(source_path, tmp_path)
+                os.replace(tmp_path, self._blob_path(content_hash, blob['ext']))
+
+            file_id = self._add_ref(content_hash, filename)
+        return file_id
+
+    def _add_ref(self, content_hash, filename):
+        # Caller holds the lock
+        file_id = str(uuid.uuid4())
+        now = time.time()
+        self._index['refs'][file_id] = {
+            'hash': content_hash,
+            'filename': filename,
+            'created': now,
+            'last_access': now
+        }
+        self._index['blobs'][content_hash]['refcount'] += 1
+        return file_id
+
+    def hash_file(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if key not in self._hash_cache:
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+            self._hash_cache[key] = hasher.hexdigest()
+        return self._hash_cache[key]
+
+    # --- Persisted metadata ---
+
+    def save_meta(self, content_hash, **fields):
+        """
+        Persists derived metadata (scan result, schema...) with a blob, so it
+        survives restarts. It is dropped together with the blob by gc.
+        """
+        with self._locked():
+            blob = self._index['blobs'].get(content_hash)
+            if blob is not None:  # Legacy uploads are memory only
+                blob.setdefault('meta', {}).update(fields)
+
+    def load_meta(self):
+        """Returns {content_hash: meta} for all blobs with persisted metadata."""
+        with self._locked(save=False):
+            return {h: dict(blob['meta']) for h, blob in self._index['blobs'].items() if blob.get('meta')}
+
+    def recent(self, limit):
+        """
+        Returns [(file_path, content_hash)] of the most recently used blobs.
+        """
+        with self._locked(save=False):
+            last_access = {}
+            for ref in self._index['refs'].values():
+                last_access[ref['hash']] = max(last_access.get(ref['hash'], 0), ref['last_access'])
+
+            result = []
+            for content_hash in sorted(last_access, key=last_access.get, reverse=True):
+                if len(result) >= limit:
+                    break
+                blob = self._index['blobs'].get(content_hash)
+                if blob is None:
+                    continue
+                path = self._blob_path(content_hash, blob['ext'])
+                if os.path.exists(path):
+                    result.append((path, content_hash))
+        return result
+
+    # --- Lookup ---
+
+    def resolve(self, file_id, extensions=ALLOWED_EXTENSIONS):
+        """
+        Returns (file_path, cache_key) for a file_id, or (None, None) if unknown.
+        cache_key is the content hash, so derived data can be shared between
+        all file_ids pointing at the same content.
+        """
+        try:
+            uuid.UUID(file_id)
+        except ValueError:
+            return None, None
+
+        with self._lock:
+            found = self._lookup(file_id, extensions)
+        if found is None:
+            # Possibly added by another process since we last read the index
+            with self._locked(save=False):
+                found = self._lookup(file_id, extensions)
+        if found is not None:
+            return found
+
+        # Fallback: uploads from before the blob store existed
+        for ext in extensions:
+            path = os.path.join(self.upload_dir, f"{file_id}{ext}")
+            if os.path.exists(path):
+                return path, file_id
+
+        return None, None
+
+    def _lookup(self, file_id, extensions):
+        # Caller holds the lock. (path, hash) for a known file_id, (None, None)
+        # if it's known but unusable, None if the index doesn't have it.
+        ref = self._index['refs'].get(file_id)
+        if ref is None:
+            return None
+        blob = self._index['blobs'].get(ref['hash'])
+        if blob is not None and blob['ext'] in extensions:
+            path = self._blob_path(ref['hash'], blob['ext'])
+            if os.path.exists(path):
+                # Only kept in memory, written with the next change of the index
+                self._touched[file_id] = ref['last_access'] = time.time()
+                return path, ref['hash']
+        return None, None
+
+    # --- Garbage collection ---
+
+    def maybe_gc(self):
+        """Runs gc if the last run is older than gc_interval."""
+        if time.time() - self._last_gc >= self.gc_interval:
+            return self.gc()
+        return []
+
+    def gc(self):
+        """
+        Drops refs not accessed within the TTL, deletes blobs whose refcount
+        reached zero, and cleans up expired legacy uploads and stale temp files.
+        Returns the content hashes / legacy ids that were removed so callers can
+        evict their caches.
+        """
+        now = time.time()
+        removed = []
+
+        with self._locked():
+            self._last_gc = now
+            refs = self._index['refs']
+            blobs = self._index['blobs']
+
+            for file_id in [fid for fid, ref in refs.items() if now - ref['last_access'] > self.ttl_seconds]:
+                ref = refs.pop(file_id)
+                if ref['hash'] in blobs:
+                    blobs[ref['hash']]['refcount'] -= 1
+
+            for content_hash in [h for h, blob in blobs.items() if blob['refcount'] <= 0]:
+                blob = blobs.pop(content_hash)
+                path = self._blob_path(content_hash, blob['ext'])
+                if os.path.exists(path):
+                    os.remove(path)
+                removed.append(content_hash)
+
+            # Orphans: blobs on disk the index doesn't know about, and abandoned
+            # temp files. Only once older than the TTL, in case another store
+            # without the file lock (Windows) just added them.
+            for name in os.listdir(self.blob_dir):
+                path = os.path.join(self.blob_dir, name)
+                if name.startswith('.tmp-') or os.path.splitext(name)[0] not in blobs:
+                    if now - os.path.getmtime(path) > self.ttl_seconds:
+                        os.remove(path)
+
+        # Legacy <uuid><ext> uploads, expired by modification time
+        for name in os.listdir(self.upload_dir):
+            path = os.path.join(self.upload_dir, name)
+            if LEGACY_FILE_RE.match(name) and now - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                removed.append(os.path.splitext(name)[0])
+
+        return removed
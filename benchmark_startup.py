@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Runs in a fresh interpreter each time, like a Cloud Run cold start
+SNIPPET = """
+import asyncio, json, sys, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+
+async def startup():
+    async with app.main.app.router.lifespan_context(app.main.app):
+        pass
+
+asyncio.run(startup())
+t2 = time.perf_counter()
+heavy_modules = [m for m in ('pandas', 'scipy', 'h5py') if m in sys.modules]
+
+# Background preloading of recently used catalogs
+if app.main.WARM_THREAD is not None:
+    app.main.WARM_THREAD.join()
+t3 = time.perf_counter()
+print(json.dumps({
+    'import': t1 - t0,
+    'startup': t2 - t1,
+    'warm': t3 - t2,
+    'heavy_modules': heavy_modules
+}))
+"""
+
+def seed_upload_dir(upload_dir):
+    """
+    Stores the demo catalog with a persisted scan and schema, like an instance
+    that has already served it.
+    """
+    from app.utils.storage import BlobStore
+    from app.utils.h5_scanner import scan_h5, detect_schema, sample_datasets
+
+    demo_filename = "demo_halo_catalog.h5"
+    store = BlobStore(upload_dir)
+    store.add_file(demo_filename, filename=demo_filename)
+    file_path, cache_key = store.recent(1)[0]
+
+    datasets = scan_h5(file_path)
+    schema, _ = detect_schema(datasets, sample_datasets(file_path, datasets))
+    store.save_meta(cache_key, scan={"datasets": datasets, "schema": schema}, schema=schema, schema_updated=0)
+
+def run_once(upload_dir, warm):
+    env = dict(os.environ, UPLOAD_DIR=upload_dir, WARM_CATALOGS=os.getenv("WARM_CATALOGS", "3") if warm else "0")
+    if warm:
+        # Every run starts without cached responses, like a fresh instance
+        shutil.rmtree(os.path.join(upload_dir, "responses"), ignore_errors=True)
+    result = subprocess.run(
+        [sys.executable, "-c", SNIPPET],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures cold start time of the backend (import + startup hooks).")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters to start")
+    parser.add_argument("--target", type=float, default=1.0, help="Target for the median cold start in seconds")
+    parser.add_argument("--warm", action="store_true",
+                        help="Seed the upload dir with the demo catalog and include the background warmup in the total")
+    args = parser.parse_args()
+
+    # Without --warm the upload dir is empty, so we measure the app and not the size of someone's uploads
+    with tempfile.TemporaryDirectory() as upload_dir:
+        if args.warm:
+            seed_upload_dir(upload_dir)
+        runs = [run_once(upload_dir, args.warm) for _ in range(args.runs)]
+
+    phases = ['import', 'startup', 'warm'] if args.warm else ['import', 'startup']
+    totals = [sum(r[phase] for phase in phases) for r in runs]
+    median = statistics.median(totals)
+
+    for phase in phases:
+        values = [r[phase] for r in runs]
+        print(f"{phase + ':':8} median {statistics.median(values) * 1000:.0f} ms, min {min(values) * 1000:.0f} ms")
+    print(f"total:   median {median * 1000:.0f} ms (target {args.target * 1000:.0f} ms)")
+    print(f"heavy modules loaded at boot: {', '.join(runs[-1]['heavy_modules']) or 'none'}")
+
+    if median > args.target:
+        print("FAIL: cold start is above target")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
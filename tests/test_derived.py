@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from app.utils.derived import DerivedColumns, parse_predicate
+
+
+@pytest.fixture
+def data():
+    return {
+        'id': np.array([1, 2, 3, 4]),
+        'parent_id': np.array([-1, 1, 1, -1]),
+        'mass': np.array([1e13, 1e11, 1e12, 1e10]),
+        'radius': np.array([1.0, 0.2, 0.4, 0.1]),
+        'x': np.array([0.0, 3.0, 0.0, 9.0]),
+        'y': np.array([0.0, 4.0, 0.0, 9.0]),
+        'z': np.array([0.0, 0.0, 2.0, 9.0]),
+    }
+
+
+def test_catalog_columns(data):
+    derived = DerivedColumns(data)
+    assert derived.get('n_subhalos').tolist() == [2, 0, 0, 0]
+    distance = derived.get('host_distance')
+    assert np.isnan(distance[0]) and np.isnan(distance[3])
+    assert distance[1:3].tolist() == [5.0, 2.0]
+
+
+def test_small_selection_not_memoized(data):
+    cache = {}
+    values = DerivedColumns(data, cache).get('log_mass', np.array([1]))
+    assert values.tolist() == [11.0]
+    assert 'log_mass' not in cache
+
+
+def test_large_selection_memoized(data):
+    cache = {}
+    values = DerivedColumns(data, cache).get('log_mass', np.array([0, 2, 3]))
+    assert values.tolist() == [13.0, 12.0, 10.0]
+    assert cache['log_mass'].tolist() == [13.0, 11.0, 12.0, 10.0]
+
+
+def test_unavailable_column():
+    derived = DerivedColumns({'mass': [1.0], 'x': [0], 'y': [0], 'z': [0], 'radius': None})
+    assert derived.available() == ['log_mass']
+    with pytest.raises(ValueError):
+        derived.get('n_subhalos')
+
+
+def test_unmapped_fields_unavailable(data):
+    # readers.py fills unmapped radius / parent_id with zeros / -1
+    schema = {'id': 'ID', 'mass': 'Mass', 'pos': 'Pos', 'radius': None, 'parent_id': None}
+    derived = DerivedColumns(data, schema=schema)
+    assert derived.available() == ['log_mass']
+
+
+@pytest.mark.parametrize('text', ['log_mass > 1.2.3', 'log_mass > e', 'log_mass ~ 1'])
+def test_invalid_predicate(text):
+    with pytest.raises(ValueError, match='Invalid filter expression'):
+        parse_predicate(text)
@@ -0,0 +1,139 @@
+import h5py
+import numpy as np
+import pytest
+
+from app.utils.h5_scanner import scan_h5, detect_schema, sample_datasets
+
+
+def write_h5(path, columns):
+    with h5py.File(path, 'w') as f:
+        for name, values in columns.items():
+            f.create_dataset(name, data=values)
+    return str(path)
+
+
+def detect(path):
+    datasets = scan_h5(path)
+    schema, _ = detect_schema(datasets, sample_datasets(path, datasets))
+    return schema
+
+
+@pytest.fixture
+def catalog():
+    """Mass-sorted catalog: the few most massive halos are the hosts."""
+    rng = np.random.default_rng(42)
+    n = 3000
+    ids = np.arange(1, n + 1)
+    mass = np.sort(10 ** rng.normal(11, 0.8, n))[::-1]
+    hosts = ids[:20]
+    parents = np.where(rng.random(n) < 0.4, -1, rng.choice(hosts, n))
+    parents[:20] = -1
+    return {
+        'ids': ids,
+        'mass': mass,
+        'radius': (mass / 1e15) ** (1 / 3),
+        'pos': rng.uniform(0, 100, (n, 3)),
+        'parents': parents,
+        'groups': np.sort(rng.integers(0, 50, n)),
+    }
+
+
+def test_demo_catalog():
+    schema = detect('demo_halo_catalog.h5')
+    assert schema == {
+        'mass': 'Catalog/Mass',
+        'pos': 'Catalog/Position',
+        'id': 'Catalog/ParticleIDs',
+        'parent_id': 'Catalog/ParentID',
+        'radius': 'Catalog/Radius',
+    }
+
+
+def test_missing_fields_stay_empty(tmp_path, catalog):
+    path = write_h5(tmp_path / 'minimal.h5', {
+        'Mass': catalog['mass'],
+        'Pos': catalog['pos'],
+        'ID': catalog['ids'],
+    })
+    schema = detect(path)
+    assert schema['id'] == 'ID'
+    assert schema['mass'] == 'Mass'
+    assert schema['pos'] == 'Pos'
+    assert schema['parent_id'] is None
+    assert schema['radius'] is None
+
+
+def test_unnamed_columns(tmp_path, catalog):
+    path = write_h5(tmp_path / 'unnamed.h5', {
+        'c0': catalog['ids'],
+        'c1': catalog['mass'],
+        'c2': catalog['parents'],
+        'c3': catalog['pos'],
+    })
+    schema = detect(path)
+    assert schema['id'] == 'c0'
+    assert schema['parent_id'] == 'c2'
+    assert schema['mass'] == 'c1'
+    assert schema['pos'] == 'c3'
+
+
+def test_parent_preferred_over_group_id(tmp_path, catalog):
+    path = write_h5(tmp_path / 'groups.h5', {
+        'Subhalo/ID': catalog['ids'],
+        'Subhalo/GroupID': catalog['groups'],
+        'Subhalo/UpLink': catalog['parents'],
+        'Subhalo/Mass': catalog['mass'],
+        'Subhalo/Pos': catalog['pos'],
+    })
+    schema = detect(path)
+    assert schema['id'] == 'Subhalo/ID'
+    assert schema['parent_id'] == 'Subhalo/UpLink'
+
+
+def test_group_id_alone_is_not_a_parent(tmp_path, catalog):
+    path = write_h5(tmp_path / 'groups_only.h5', {
+        'ID': catalog['ids'],
+        'GroupID': catalog['groups'],
+        'Mass': catalog['mass'],
+        'Pos': catalog['pos'],
+    })
+    schema = detect(path)
+    assert schema['id'] == 'ID'
+    assert schema['parent_id'] is None
+
+
+def test_id_copy_is_not_a_parent(tmp_path, catalog):
+    path = write_h5(tmp_path / 'copy.h5', {
+        'ID': catalog['ids'],
+        'HostID': catalog['ids'],
+        'Mass': catalog['mass'],
+        'Pos': catalog['pos'],
+    })
+    schema = detect(path)
+    assert schema['id'] == 'ID'
+    assert schema['parent_id'] is None
+
+
+def test_each_dataset_mapped_once(tmp_path, catalog):
+    path = write_h5(tmp_path / 'radius.h5', {
+        'ID': catalog['ids'],
+        'Mass': catalog['mass'],
+        'Radius': catalog['radius'],
+        'Pos': catalog['pos'],
+    })
+    schema = detect(path)
+    assert schema['radius'] == 'Radius'
+    paths = [p for p in schema.values() if p is not None]
+    assert len(paths) == len(set(paths))
+
+
+def test_name_only_detection(catalog, tmp_path):
+    path = write_h5(tmp_path / 'named.h5', {
+        'ID': catalog['ids'],
+        'ParentID': catalog['parents'],
+        'Mass': catalog['mass'],
+        'Pos': catalog['pos'],
+    })
+    schema, _ = detect_schema(scan_h5(path))
+    assert schema['id'] == 'ID'
+    assert schema['parent_id'] == 'ParentID'
@@ -0,0 +1,58 @@
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.utils.http_cache import ResponseCache, make_etag, negotiate_encoding
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding('gzip, deflate') == 'gzip'
+    assert negotiate_encoding('gzip;q=0') == 'identity'
+    assert negotiate_encoding(None) == 'identity'
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_entries=2)
+    etags = [make_etag('catalog', i) for i in range(3)]
+
+    cache.warm('catalog', etags[0], lambda: {'n': 0})
+    cache.warm('catalog', etags[1], lambda: {'n': 1})
+    # Use the first entry again, so the second is the least recently used
+    os.utime(cache._path('catalog', etags[1], 'identity'), (0, 0))
+    cache.warm('catalog', etags[0], lambda: {'n': 0})
+    cache.warm('catalog', etags[2], lambda: {'n': 2})
+
+    kept = sorted(os.listdir(tmp_path / 'catalog'))
+    assert kept == sorted(etag.strip('"') + '.identity' for etag in (etags[0], etags[2]))
+
+
+def test_respond(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    etag = make_etag('catalog')
+    app = FastAPI()
+
+    @app.get('/data')
+    def data(request: Request):
+        return cache.respond(request, 'catalog', etag, 0, lambda: {'mass': list(range(1000))})
+
+    client = TestClient(app)
+    identity = {'Accept-Encoding': 'identity'}
+    response = client.get('/data', headers=identity)
+    assert response.status_code == 200
+    assert response.json()['mass'][-1] == 999
+    assert response.headers['etag'] == etag
+
+    response = client.get('/data', headers={**identity, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+
+    # Compressed bodies are a different representation with their own tag
+    response = client.get('/data', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['etag'] != etag
+    # The test client decompresses the body
+    assert response.content == client.get('/data', headers=identity).content
+
+    response = client.get('/data', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['etag']})
+    assert response.status_code == 304
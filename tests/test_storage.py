@@ -0,0 +1,89 @@
+import os
+import uuid
+
+import pytest
+
+from app.utils.storage import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path), ttl_seconds=60)
+
+
+def upload(store, content, ext='.h5'):
+    tmp_path = store.new_temp_path()
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    return store.commit(tmp_path, store.hash_file(tmp_path), ext, filename='catalog' + ext)
+
+
+def expire(store, file_id):
+    with store._locked():
+        store._index['refs'][file_id]['last_access'] -= 2 * store.ttl_seconds
+    store._touched.clear()
+
+
+def test_duplicate_upload_reuses_blob(store):
+    first, second = upload(store, b'halos'), upload(store, b'halos')
+    assert first != second
+    assert store.resolve(first) == store.resolve(second)
+    assert os.listdir(store.blob_dir) == [store.resolve(first)[1] + '.h5']
+
+
+def test_ref_expires_after_ttl(store):
+    old, new = upload(store, b'halos'), upload(store, b'halos')
+    expire(store, old)
+
+    assert store.gc() == []
+    assert store.resolve(old) == (None, None)
+    assert store.resolve(new)[0] is not None
+
+
+def test_blob_removed_at_refcount_zero(store):
+    file_id = upload(store, b'halos')
+    path, content_hash = store.resolve(file_id)
+    expire(store, file_id)
+
+    assert store.gc() == [content_hash]
+    assert not os.path.exists(path)
+
+
+def test_lost_blob_keeps_refs_and_meta(store):
+    file_id = upload(store, b'halos')
+    path, content_hash = store.resolve(file_id)
+    store.save_meta(content_hash, schema={'mass': 'Mass'})
+    os.remove(path)
+
+    upload(store, b'halos')
+    assert os.path.exists(path)
+    assert store._index['blobs'][content_hash]['refcount'] == 2
+    assert store.load_meta() == {content_hash: {'schema': {'mass': 'Mass'}}}
+
+
+def test_stale_temp_files_removed(store):
+    stale, fresh = store.new_temp_path(), store.new_temp_path()
+    for path in (stale, fresh):
+        open(path, 'wb').close()
+    os.utime(stale, (0, 0))
+
+    store.gc()
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+
+
+def test_gc_keeps_blobs_added_by_other_store(tmp_path):
+    first, second = BlobStore(str(tmp_path)), BlobStore(str(tmp_path))
+    file_id = upload(second, b'halos')
+
+    first.gc()
+    assert first.resolve(file_id)[0] is not None
+
+
+def test_resolve_legacy_upload(store):
+    file_id = str(uuid.uuid4())
+    path = os.path.join(store.upload_dir, file_id + '.h5')
+    open(path, 'wb').close()
+
+    assert store.resolve(file_id) == (path, file_id)
+    assert store.resolve(file_id, extensions=('.csv',)) == (None, None)